@@ -1,55 +1,212 @@
-import aubio
-import numpy as np # Aubio 通常与 numpy 结合使用
+import os
+import subprocess
+import librosa
+import numpy as np
+import soundfile as sf
+from numba import njit, prange
+from scipy.fft import rfft
 
 # WAV文件的路径
 audio_file = '100.wav'
 
-samplerate = 0 # 设置为0让aubio从文件中读取
 win_s = 512    # FFT 窗口大小
 hop_s = win_s // 2 # 帧之间的跳数
+block_hops = 64 # 每次 FFT 调用批量处理的帧数
+n_mels = 128   # 起音包络使用的 mel 频带数
+log_gain = 10  # 对数压缩 log1p(log_gain * mel / max(mel)) 的增益
+ffmpeg_samplerate = 44100 # 用 ffmpeg 解码时的重采样率
 
-try:
-    # 创建音频源对象
-    s = aubio.source(audio_file, samplerate, hop_s)
-    samplerate = s.samplerate # 获取实际采样率
-
-    # 创建 tempo (BPM) 检测对象
-    o = aubio.tempo("default", win_s, hop_s, samplerate)
-
-    # 存储检测到的节拍时间点
-    beats = []
-    # 总帧数
-    total_frames = 0
-
-    while True:
-        samples, read = s() # 读取一帧
-        is_beat = o(samples) # 检测节拍
-        if is_beat:
-            # 记录节拍发生的时间（以秒为单位）
-            beats.append(o.get_last_s())
-            # 你也可以直接获取当前的BPM估计：
-            # current_bpm = o.get_bpm()
-            # print(f"Current estimated BPM: {current_bpm}")
-        total_frames += read
-        if read < hop_s: # 到达文件末尾
-            break
-
-    # 计算整体 BPM 的一种方法（基于检测到的节拍间隔）
+
+def load_audio(path):
+    """
+    一次性把整个音频文件解码为单声道 float32 数组，返回 (y, samplerate)
+
+    优先用 libsndfile (soundfile) 读取；它不支持的格式（如旧版 libsndfile 下的 MP3）
+    退回到调用一次 ffmpeg，直接输出单声道 float32 PCM。没有 ffmpeg 或 ffmpeg 也解码失败时，
+    抛出 soundfile 原来的错误
+
+    Args:
+        path (str): 音频文件路径
+    """
+    # 文件不存在时 soundfile 同样抛 RuntimeError 的子类，先排除，免得再去调用 ffmpeg
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"音频文件不存在: {path}")
+    try:
+        y, samplerate = sf.read(path, dtype='float32', always_2d=False)
+    except RuntimeError as sf_error: # soundfile 无法识别的格式
+        try:
+            result = subprocess.run(
+                ['ffmpeg', '-v', 'error', '-i', path, '-f', 'f32le', '-ac', '1', '-ar', str(ffmpeg_samplerate), '-'],
+                capture_output=True, check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            raise sf_error from None
+        return np.frombuffer(result.stdout, dtype=np.float32), ffmpeg_samplerate
+
+    if y.ndim > 1:
+        y = y.mean(axis=1) # 混合为单声道
+    return y, samplerate
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def spectral_flux(log_mag, flux):
+    """
+    由对数幅度谱计算频谱通量：沿时间差分、半波整流、按频率求和融合在一个编译内核里，
+    按帧用 prange 并行，不产生中间数组
+
+    Args:
+        log_mag (np.ndarray): 形状为 (n + 1, bins) 的对数幅度谱，第一行是上一块的最后一帧
+        flux (np.ndarray): 长度为 n 的输出
+    """
+    n_rows, n_bins = log_mag.shape
+    for f in prange(n_rows - 1):
+        acc = 0.0
+        for k in range(n_bins):
+            d = log_mag[f + 1, k] - log_mag[f, k]
+            if d > 0:
+                acc += d
+        flux[f] = acc
+
+
+def mel_filterbank(samplerate, n_fft, n_mels=n_mels, fmin=0.0, fmax=None):
+    """
+    构造 Slaney 式 mel 三角滤波器组（与 librosa.filters.mel 的默认参数一致），
+    形状为 (n_mels, n_fft // 2 + 1)
+
+    Args:
+        samplerate (int): 采样率
+        n_fft (int): FFT 窗口大小
+        n_mels (int): mel 频带数
+        fmin, fmax (float): 频率范围，fmax 默认为奈奎斯特频率
+    """
+    if fmax is None:
+        fmax = samplerate / 2.0
+
+    # Slaney mel 刻度：1 kHz 以下线性，以上对数
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+
+    def hz_to_mel(hz):
+        hz = np.asanyarray(hz, dtype=np.float64)
+        return np.where(hz >= min_log_hz, min_log_mel + np.log(np.maximum(hz, min_log_hz) / min_log_hz) / logstep, hz / f_sp)
+
+    def mel_to_hz(mel):
+        return np.where(mel >= min_log_mel, min_log_hz * np.exp(logstep * (mel - min_log_mel)), f_sp * mel)
+
+    fft_freqs = np.linspace(0, samplerate / 2.0, n_fft // 2 + 1)
+    mel_freqs = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+
+    # 每个三角滤波器在 fft_freqs 上的上升沿与下降沿
+    fdiff = np.diff(mel_freqs)
+    ramps = mel_freqs[:, None] - fft_freqs[None, :]
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    # 按带宽归一化，使各频带能量大致相当
+    weights *= (2.0 / (mel_freqs[2:] - mel_freqs[:-2]))[:, None]
+    return weights.astype(np.float32)
+
+
+def onset_envelope(y, win_s, hop_s, samplerate, block_hops=block_hops):
+    """
+    分块批量做 STFT，计算对数 mel 频谱通量（spectral flux）起音包络
+
+    与 librosa.onset.onset_strength 的做法相同，幅度谱先投影到 mel 频带，
+    再以全曲最大值为参考做对数压缩，避免大量高频线性频点和响亮的持续音主导通量，
+    且结果与录音音量无关。每次 FFT 调用处理 block_hops 帧，既避免逐帧的 Python 调用，
+    又不必为整段音频分配完整的线性频谱矩阵（只保留 n_mels 个频带）
+
+    Args:
+        y (np.ndarray): 单声道 float32 音频
+        win_s (int): FFT 窗口大小
+        hop_s (int): 帧之间的跳数
+        samplerate (int): 采样率
+        block_hops (int): 每块的帧数
+    """
+    if len(y) < win_s:
+        return np.empty(0, dtype=np.float32) # 不足一帧，没有可用的起音包络
+
+    # 按 hop_s 步长切出所有帧（零拷贝视图）
+    frames = np.lib.stride_tricks.sliding_window_view(y, win_s)[::hop_s]
+    n_frames = len(frames)
+    window = np.hanning(win_s).astype(np.float32)
+    mel_basis = mel_filterbank(samplerate, win_s).T
+
+    # 预分配 mel 谱和加窗、幅度缓冲区，按游标逐块写入
+    mel = np.empty((n_frames, mel_basis.shape[1]), dtype=np.float32)
+    buf = np.empty((block_hops, win_s), dtype=np.float32)
+    mag = np.empty((block_hops, win_s // 2 + 1), dtype=np.float32)
+    for start in range(0, n_frames, block_hops):
+        stop = min(start + block_hops, n_frames)
+        block = buf[:stop - start]
+        np.multiply(frames[start:stop], window, out=block)
+        block_mag = mag[:len(block)]
+        np.abs(rfft(block, axis=1), out=block_mag)
+        np.matmul(block_mag, mel_basis, out=mel[start:stop])
+
+    # 对数压缩原地进行，再由编译内核做正向差分并按频带求和；第一帧没有前一帧，记为 0
+    ref = mel.max()
+    if ref > 0:
+        mel *= log_gain / ref
+    np.log1p(mel, out=mel)
+    env = np.empty(n_frames, dtype=np.float32)
+    env[0] = 0
+    spectral_flux(mel, env[1:])
+    return env
+
+
+@njit(cache=True, fastmath=True)
+def robust_bpm(beats):
+    """
+    由节拍时间点计算 BPM 的中位数：差分、倒数和选择在一个循环里完成，
+    用快速选择 (np.partition, O(n)) 代替 np.median 的完整排序
+
+    Args:
+        beats (np.ndarray): 节拍时间点（秒），长度至少为 2
+    """
+    n = len(beats) - 1
+    buf = np.empty(n)
+    for i in range(n):
+        buf[i] = 60.0 / (beats[i + 1] - beats[i])
+
+    half = n // 2
+    buf = np.partition(buf, half)
+    if n % 2 == 1:
+        return buf[half]
+    # 偶数个间隔时取两个中间值的平均，partition 后较小的那个是前半段的最大值
+    return 0.5 * (buf[half] + buf[:half].max())
+
+
+def estimate_bpm(env, samplerate, hop_s):
+    """
+    基于起音包络做节拍跟踪（librosa.beat.beat_track），以相邻节拍间隔对应 BPM 的中位数
+    作为整体 BPM；节拍不足两个时退回到节拍跟踪器给出的全局 tempo 估计，仍无结果时返回 0
+
+    Args:
+        env (np.ndarray): 起音包络，每 hop_s 个采样一个值
+        samplerate (int): 采样率
+        hop_s (int): 帧之间的跳数
+    """
+    tempo, beats = librosa.beat.beat_track(onset_envelope=env, sr=samplerate, hop_length=hop_s, units='time')
     if len(beats) > 1:
-        # 计算相邻节拍之间的时间间隔的中位数
-        bpms = 60. / np.diff(beats)
-        estimated_bpm = np.median(bpms)
-        print(bpms)
-        print(f"文件的估计 BPM (基于节拍间隔中位数): {estimated_bpm:.2f}")
-    else:
-        # 如果节拍数太少，尝试获取最后一次的BPM估计值
-        # 注意：这可能不如基于间隔的方法稳定
-        final_bpm_estimate = o.get_bpm()
-        if final_bpm_estimate > 0:
-             print(f"文件的估计 BPM (基于aubio最终估计): {final_bpm_estimate:.2f}")
-        else:
-             print("未能检测到足够的节拍来估计BPM。")
+        return float(robust_bpm(beats))
+    # 注意：全局 tempo 估计可能不如基于间隔的方法稳定
+    return float(np.atleast_1d(tempo)[0])
+
 
+if __name__ == '__main__':
+    try:
+        # 一次性读取并解码整个音频文件
+        y, samplerate = load_audio(audio_file)
+        env = onset_envelope(y, win_s, hop_s, samplerate)
+        estimated_bpm = estimate_bpm(env, samplerate, hop_s)
+
+        if estimated_bpm > 0:
+            print(f"文件的估计 BPM (基于节拍间隔中位数): {estimated_bpm:.2f}")
+        else:
+            print("未能检测到足够的节拍来估计BPM。")
 
-except Exception as e:
-    print(f"处理文件时出错: {e}")
\ No newline at end of file
+    except Exception as e:
+        print(f"处理文件时出错: {e}")
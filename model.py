@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from sklearn.preprocessing import MinMaxScaler, StandardScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 from sklearn.model_selection import train_test_split
@@ -28,6 +27,8 @@ class FitRecSpeedPredictor:
         self.window_duration = window_duration
         self.prediction_duration = prediction_duration
         self.model = None
+        self._inference_fn = None # Compiled forward pass, see compile_for_inference
+        self._inference_batch_sizes = []
         self.speed_scaler = MinMaxScaler()
         self.hr_scaler = MinMaxScaler()
         self.target_scaler = MinMaxScaler()
@@ -414,6 +415,7 @@ class FitRecSpeedPredictor:
             
         # Create and compile model
         self.model = self.create_model(input_shape=(X_train.shape[1], X_train.shape[2]))
+        self._inference_fn = None
         if verbose > 0:
             print(self.model.summary())
         
@@ -609,20 +611,79 @@ class FitRecSpeedPredictor:
         if input_sequence.shape[0] != window_samples or input_sequence.shape[1] != 2:
             raise ValueError(f"Input should have shape ({window_samples}, 2), got {input_sequence.shape}")
 
-        # Scale input
-        speed_scaled = self.speed_scaler.transform(input_sequence[:, [0]])
-        hr_scaled = self.hr_scaler.transform(input_sequence[:, [1]])
+        return self.predict_batch(input_sequence[np.newaxis])[0]
+
+    def predict_batch(self, input_sequences):
+        """
+        Make predictions for a batch of input sequences with a single model call
+
+        Args:
+            input_sequences (np.array): Input sequences of shape (batch_size, window_samples, 2)
+                                      where columns are [speed, heart_rate]
+
+        Returns:
+            np.array: Predicted speeds of shape (batch_size,)
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet!")
+
+        # Calculate expected window size
+        window_samples = int(self.window_duration / self.sampling_rate)
+
+        # Ensure correct shape
+        if input_sequences.ndim != 3 or input_sequences.shape[1] != window_samples or input_sequences.shape[2] != 2:
+            raise ValueError(f"Input should have shape (batch_size, {window_samples}, 2), got {input_sequences.shape}")
+        batch_size = input_sequences.shape[0]
+
+        # Scale input (scalers work on a single column, so flatten the batch and time axes)
+        speed_scaled = self.speed_scaler.transform(input_sequences[:, :, 0].reshape(-1, 1))
+        hr_scaled = self.hr_scaler.transform(input_sequences[:, :, 1].reshape(-1, 1))
         input_scaled = np.concatenate([speed_scaled, hr_scaled], axis=1)
 
         # Reshape for prediction
-        input_scaled = input_scaled.reshape(1, window_samples, 2)
+        input_scaled = input_scaled.reshape(batch_size, window_samples, 2)
 
         # Make prediction
-        pred_scaled = self.model.predict(input_scaled, verbose=0)
+        if self._inference_fn is None:
+            pred_scaled = self.model.predict(input_scaled, verbose=0)
+        else:
+            # Pad up to the nearest warmed-up batch size so an already compiled graph is reused
+            padded_size = next((size for size in self._inference_batch_sizes if size >= batch_size), batch_size)
+            if padded_size > batch_size:
+                padding = np.zeros((padded_size - batch_size, window_samples, 2), dtype=input_scaled.dtype)
+                input_scaled = np.concatenate([input_scaled, padding])
+            pred_scaled = self._inference_fn(input_scaled.astype(np.float32, copy=False)).numpy()[:batch_size]
 
         # Inverse transform
         pred_orig = self.target_scaler.inverse_transform(pred_scaled.reshape(-1, 1))
-        return pred_orig[0, 0]
+        return pred_orig[:, 0]
+
+    def compile_for_inference(self, batch_sizes=(1,), jit_compile=True):
+        """
+        Replace model.predict in predict/predict_batch with a tf.function over a fixed
+        input signature (optionally XLA-compiled), and warm it up once per batch size
+        so graph tracing and compilation happen here rather than on the first predictions
+
+        Args:
+            batch_sizes (iterable): Batch sizes to compile for; larger batches are padded up to the next one
+            jit_compile (bool): Whether to compile the forward pass with XLA
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet!")
+
+        window_samples = int(self.window_duration / self.sampling_rate)
+        model = self.model
+
+        @tf.function(jit_compile=jit_compile,
+                     input_signature=[tf.TensorSpec(shape=(None, window_samples, 2), dtype=tf.float32)])
+        def inference_fn(x):
+            return model(x, training=False)
+
+        self._inference_batch_sizes = sorted(set(batch_sizes))
+        for batch_size in self._inference_batch_sizes:
+            inference_fn(tf.zeros((batch_size, window_samples, 2), dtype=tf.float32))
+        self._inference_fn = inference_fn
+        print(f"Compiled inference graph (jit_compile={jit_compile}) for batch sizes {self._inference_batch_sizes}")
 
     def predict_from_dataframe(self, df, start_idx):
         """
@@ -645,6 +706,8 @@ class FitRecSpeedPredictor:
         """
         Plot training history
         """
+        import matplotlib.pyplot as plt # Imported lazily so serving the model never loads matplotlib
+
         fig, axes = plt.subplots(1, 2, figsize=(15, 5))
 
         # Loss
@@ -672,6 +735,8 @@ class FitRecSpeedPredictor:
         """
         Plot prediction results
         """
+        import matplotlib.pyplot as plt # Imported lazily so serving the model never loads matplotlib
+
         # Limit samples for clearer visualization
         if len(y_true) > n_samples:
             indices = np.linspace(0, len(y_true)-1, n_samples, dtype=int)
@@ -805,6 +870,7 @@ class FitRecSpeedPredictor:
             num_features = 2 # speed, heart_rate
             input_shape = (window_samples, num_features)
             self.model = self.create_model(input_shape=input_shape)
+            self._inference_fn = None
 
             weights_filename = config["model_weights_path"]
             full_weights_path = config_p.parent / weights_filename
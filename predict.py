@@ -1,14 +1,19 @@
+import calendar
 import json
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError # builtin TimeoutError only from Python 3.11
 import numpy as np
+import orjson
 import pandas as pd
 from flask_cors import CORS # 导入 CORS
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from pathlib import Path
 from fitparse import FitFile
 import os
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg') # Use Agg backend for non-interactive plotting
 
 # Attempt to import the model class
 try:
@@ -26,20 +31,109 @@ except ImportError:
         raise ImportError(f"Could not import FitRecSpeedPredictor from model.py: {e}. Ensure model.py is accessible.")
 
 
+class OrjsonProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, which encodes small dicts several times
+    faster than the stdlib json module used by Flask's default provider.
+    NumPy scalars and arrays are serialized natively, so responses need no
+    int()/float() coercion.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class PredictionBatcher:
+    """
+    Micro-batches concurrent prediction requests. Callers enqueue a single
+    input window and block on a future; a background thread drains up to
+    max_batch pending windows (waiting at most max_wait_ms for stragglers)
+    and runs them through one predictor.predict_batch call.
+    """
+    def __init__(self, predictor, max_batch=32, max_wait_ms=10):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_batch * 4)
+        self._worker = threading.Thread(target=self._run, name="prediction-batcher", daemon=True)
+        self._worker.start()
+
+    def predict(self, input_array, timeout=None):
+        """
+        Queues one (window_samples, 2) input window and waits for its predicted speed.
+        Raises queue.Full if the queue stays full, or TimeoutError if no result arrives, within timeout seconds
+        (one deadline covers both the wait for a queue slot and the wait for the result).
+        """
+        future = Future()
+        if timeout is None:
+            self._queue.put((input_array, future))
+            return future.result()
+
+        deadline = time.monotonic() + timeout
+        self._queue.put((input_array, future), timeout=timeout)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # Drop the request if the worker hasn't picked it up yet, so it costs no model time
+            future.cancel()
+            raise
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Skip requests whose caller already gave up and cancelled them
+            batch = [(x, future) for x, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            inputs, futures = zip(*batch)
+            try:
+                predictions = self.predictor.predict_batch(np.stack(inputs))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, prediction in zip(futures, predictions):
+                    future.set_result(prediction)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app) # jsonify 使用 orjson 序列化
 CORS(app) # 在这里启用 CORS，允许所有源的请求
 
 # --- Global Variables ---
 predictor = None
-demo_item_df = None
+batcher = None
+# The demo session is kept as one NumPy array per column, so request handlers index
+# positionally without going through pandas
+_N = 0 # Number of samples in the demo session
+_TS = None # Unix timestamps
+_HR = None # Heart rate
+_SPEED = None # Speed
+_ORIGIN_TS = None # Seconds since the first timestamp, sorted ascending
+_FEATURES = None # C-contiguous float32 (N, 2) array of [speed, heart_rate] model inputs
+_MODEL_WINDOW_SAMPLES = 0 # Samples per model input window, fixed once the model config is loaded
+_SAMPLES_TO_ADVANCE = 0 # Samples between consecutive /demo_predict windows
 DEMO_ID = 35
 MODEL_CONFIG_PATH = "model.json" # Path to the model configuration
+DEMO_DATA_PATH = "data/raw_run_data.npy" # Pickled list of session dicts
+STRUCTURED_DEMO_DATA_PATH = "data/raw_run_data_structured.npy" # Memory-mappable copy, used when present
+MAX_BATCH = int(os.environ.get('MAX_BATCH', 32)) # Max /demo_predict requests served by one model call
+MAX_WAIT_MS = float(os.environ.get('MAX_WAIT_MS', 10)) # Max time a batch waits to fill up
+PREDICT_TIMEOUT_S = float(os.environ.get('PREDICT_TIMEOUT_S', 5)) # Max time a request waits for its prediction
+GENERATE_DEMO_PLOT = os.environ.get('GENERATE_DEMO_PLOT') == '1' # Plot the demo session at startup (loads matplotlib)
 def extract_fit_data():
-    # 用于存储提取数据的列表
-    timestamps = []
-    heart_rates = []
-    speeds = []
-
     file_path = '5k.fit' # 确保这个文件与你的脚本在同一目录下，或者提供完整路径
 
     print(f"Attempting to process '{file_path}'...")
@@ -49,42 +143,47 @@ def extract_fit_data():
         # 这会尝试忽略 CRC 校验错误，但如果文件有更严重的结构问题，仍然可能失败
         fitfile = FitFile(file_path, check_crc=False)
 
-        # 遍历文件中的 'record' 消息 (这些通常包含逐秒的数据)
-        for record in fitfile.get_messages('record'):
-            # 从每个记录中提取所需字段的值
-            # record.get_value('field_name') 会在字段不存在时返回 None，这比直接访问更安全
-
-            timestamp_val = record.get_value('timestamp')
-            heart_rate_val = record.get_value('heart_rate')
-            speed_val = record.get_value('speed') # 速度通常以 m/s 为单位
-
-            # 将提取的值（即使是 None）附加到各自的列表中
-            timestamps.append(timestamp_val)
-            heart_rates.append(heart_rate_val)
-            speeds.append(speed_val)
+        # 一次性解析出所有 'record' 消息 (这些通常包含逐秒的数据)，以便按记录数预分配数组
+        records = list(fitfile.get_messages('record'))
+        num_records = len(records)
 
         # 检查是否收集到了数据
-        if not timestamps:
+        if num_records == 0:
             print("No 'record' messages found or no data extracted.")
         else:
-            # 使用收集到的数据创建 pandas DataFrame
+            # 每个字段一个预分配的列数组 (Struct-of-Arrays)，缺失值分别记为 -1 / 0 / NaN
+            timestamps = np.empty(num_records, dtype='int64')
+            heart_rates = np.empty(num_records, dtype='i2')
+            speeds = np.empty(num_records, dtype='f4')
+
+            for i, record in enumerate(records):
+                # record.get_values() 一次返回所有字段的字典，比逐个调用 get_value 更便宜
+                values = record.get_values()
+                timestamp_val = values.get('timestamp') # fitparse 已经将 timestamp 解析为不带时区的 UTC datetime 对象
+                heart_rate_val = values.get('heart_rate')
+                speed_val = values.get('speed') # 速度通常以 m/s 为单位
+
+                # 直接转换为 Unix 时间戳 (秒)；timegm 按 UTC 解释，而 datetime.timestamp() 会按本地时区解释
+                timestamps[i] = calendar.timegm(timestamp_val.timetuple()) if timestamp_val is not None else -1
+                heart_rates[i] = heart_rate_val if heart_rate_val is not None else 0
+                speeds[i] = speed_val if speed_val is not None else np.nan
+
+            # 一次向量化清洗：丢弃任一字段缺失的记录
+            mask = ~((timestamps < 0) | (heart_rates == 0) | np.isnan(speeds))
+            timestamps = timestamps[mask]
+            heart_rates = heart_rates[mask]
+            speeds = speeds[mask]
+
+            speeds *= 3.6
+
+            # 最后才构建 DataFrame，直接复用上面的数组
+            # 如需可读的 datetime，可按需用 pd.to_datetime(df['timestamp'], unit='s') 生成
             df = pd.DataFrame({
                 'timestamp': timestamps,
                 'heart_rate': heart_rates,
-                'speed': speeds
-            })
-            df=df.dropna()
-
-            # （可选）将 timestamp 列转换为更易读的格式或设置为索引
-            # fitparse 通常已经将 timestamp 解析为 datetime 对象
-            # df['timestamp'] = pd.to_datetime(df['timestamp']) # 如果需要确保
-            # df.set_index('timestamp', inplace=True) # 如果想把时间戳设为索引
-            df['timestamp_dt'] = pd.to_datetime(df['timestamp']) # 保留原始datetime对象，方便查看
-            df['speed'] = df['speed']*3.6
-
-            # 然后转换为 Unix 时间戳 (毫秒)，并确保为64位整数类型以容纳大数值
-            df['timestamp'] = df['timestamp_dt'].astype('int64') // 10**9
-            df['origin_timestamp'] = df['timestamp'] - df['timestamp'].iloc[0]
+                'speed': speeds,
+                'origin_timestamp': timestamps - timestamps[0]
+            }, copy=False)
 
             # 打印 DataFrame 的信息和前几行以供查阅
             print("\nDataFrame Info:")
@@ -98,62 +197,117 @@ def extract_fit_data():
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         
-def load_demo_data(data_path_str="data/raw_run_data.npy", session_id_to_load=0):
+def convert_run_data_to_structured(src_path_str=DEMO_DATA_PATH, dst_path_str=STRUCTURED_DEMO_DATA_PATH):
+    """
+    One-off offline conversion of the pickled session list into a structured
+    array with one fixed-size row per session, which load_demo_data can
+    memory-map instead of unpickling every session.
+    """
+    raw_data = np.load(src_path_str, allow_pickle=True)
+    sessions = raw_data.item() if raw_data.ndim == 0 else raw_data
+    if isinstance(sessions, dict):
+        sessions = [sessions]
+
+    keys = ('heart_rate', 'speed', 'timestamp')
+    session_lens = [min(len(session[k]) for k in keys) if all(k in session for k in keys) else 0 for session in sessions]
+    max_len = max(session_lens, default=0)
+
+    dtype = np.dtype([
+        ('heart_rate', 'f4', (max_len,)),
+        ('speed', 'f4', (max_len,)),
+        ('timestamp', 'f8', (max_len,)), # float so missing (None) timestamps can be stored as NaN
+        ('len', 'i4')
+    ])
+    # Sessions missing a key keep len 0, so session indices still line up with DEMO_ID
+    structured = np.zeros(len(sessions), dtype=dtype)
+    for i, (session, session_len) in enumerate(zip(sessions, session_lens)):
+        if session_len == 0:
+            continue
+        for k in keys:
+            structured[k][i, :session_len] = np.asarray(session[k], dtype=float)[:session_len]
+        structured['len'][i] = session_len
+
+    np.save(dst_path_str, structured)
+    print(f"Converted {len(sessions)} sessions (max length {max_len}) from {src_path_str} to {dst_path_str}")
+
+def _as_int_if_integral(values):
+    """Return a float array as int64 when every value is a whole number, otherwise unchanged."""
+    if np.array_equal(values, np.trunc(values)):
+        return values.astype(np.int64)
+    return values
+
+def load_demo_data(data_path_str=DEMO_DATA_PATH, session_id_to_load=0):
     """
     Loads a specific session from the .npy file to be used as demo data.
-    It expects the session data to be a dictionary containing at least
-    'tar_heart_rate', 'tar_derived_speed', and 'timestamp'.
+    It expects either the pickled session list, where each session is a
+    dictionary containing at least 'heart_rate', 'speed' and 'timestamp',
+    or the structured array written by convert_run_data_to_structured.
     """
     data_path = Path(data_path_str)
     if not data_path.exists():
         raise FileNotFoundError(f"Demo data file not found: {data_path}")
 
-    raw_data = np.load(data_path, allow_pickle=True)
+    try:
+        # Structured (non-object) arrays are memory-mapped, so only the pages of the requested session are read
+        raw_data = np.load(data_path, mmap_mode='r')
+    except ValueError:
+        # Object arrays (pickled session dicts) can't be memory-mapped and have to be loaded in full
+        raw_data = np.load(data_path, allow_pickle=True)
     session_dict = None
 
-    # Determine the actual data structure to process
-    if isinstance(raw_data, np.ndarray) and raw_data.ndim == 0:
-        # Case: .npy file is a 0-dim array containing a single Python object (list or dict)
-        actual_data_to_process = raw_data.item()
-        print(f"Unpacked 0-dim NumPy array. Data type after unpacking: {type(actual_data_to_process)}")
+    if raw_data.dtype.names is not None:
+        # Case: structured array of fixed-size sessions written by convert_run_data_to_structured
+        if not (0 <= session_id_to_load < len(raw_data)):
+            raise ValueError(f"DEMO_ID {session_id_to_load} is out of bounds for the structured data array (length {len(raw_data)}).")
+        session = raw_data[session_id_to_load]
+        session_len = int(session['len'])
+        # Zero-copy views into the memory map, trimmed to the session's real length
+        session_dict = {key: session[key][:session_len] for key in ('heart_rate', 'speed', 'timestamp')}
+        print(f"Loaded session {session_id_to_load} from memory-mapped structured array for demo.")
     else:
-        # Case: .npy file is a list, a dict, or a multi-dimensional array (e.g., array of dicts)
-        actual_data_to_process = raw_data
-        print(f"Loaded data directly. Data type: {type(actual_data_to_process)}")
-
-    # Extract the specific session dictionary
-    if isinstance(actual_data_to_process, list):
-        if 0 <= session_id_to_load < len(actual_data_to_process):
-            session_data_item = actual_data_to_process[session_id_to_load]
-            if isinstance(session_data_item, dict):
-                session_dict = session_data_item
-                print(f"Loaded session {session_id_to_load} from list for demo.")
-            else:
-                raise TypeError(f"Item at index {session_id_to_load} in list is not a dict, but {type(session_data_item)}")
+        # Determine the actual data structure to process
+        if isinstance(raw_data, np.ndarray) and raw_data.ndim == 0:
+            # Case: .npy file is a 0-dim array containing a single Python object (list or dict)
+            actual_data_to_process = raw_data.item()
+            print(f"Unpacked 0-dim NumPy array. Data type after unpacking: {type(actual_data_to_process)}")
         else:
-            raise ValueError(f"DEMO_ID {session_id_to_load} is out of bounds for the data list (length {len(actual_data_to_process)}).")
-    elif isinstance(actual_data_to_process, dict):
-        # This case implies the entire .npy file is a single session dictionary.
-        # session_id_to_load might be ignored here unless further logic is added.
-        session_dict = actual_data_to_process
-        print("Loaded single session dict for demo.")
-    elif isinstance(actual_data_to_process, np.ndarray):
-        # Handles cases where actual_data_to_process is an array of objects (e.g., dicts)
-        print(f"Data is a NumPy array with shape {actual_data_to_process.shape} and dtype {actual_data_to_process.dtype}.")
-        if actual_data_to_process.ndim >= 1: # Check if it's at least 1D
+            # Case: .npy file is a list, a dict, or a multi-dimensional array (e.g., array of dicts)
+            actual_data_to_process = raw_data
+            print(f"Loaded data directly. Data type: {type(actual_data_to_process)}")
+
+        # Extract the specific session dictionary
+        if isinstance(actual_data_to_process, list):
             if 0 <= session_id_to_load < len(actual_data_to_process):
-                potential_session = actual_data_to_process[session_id_to_load]
-                if isinstance(potential_session, dict):
-                    session_dict = potential_session
-                    print(f"Loaded session {session_id_to_load} from NumPy array of objects for demo.")
+                session_data_item = actual_data_to_process[session_id_to_load]
+                if isinstance(session_data_item, dict):
+                    session_dict = session_data_item
+                    print(f"Loaded session {session_id_to_load} from list for demo.")
+                else:
+                    raise TypeError(f"Item at index {session_id_to_load} in list is not a dict, but {type(session_data_item)}")
+            else:
+                raise ValueError(f"DEMO_ID {session_id_to_load} is out of bounds for the data list (length {len(actual_data_to_process)}).")
+        elif isinstance(actual_data_to_process, dict):
+            # This case implies the entire .npy file is a single session dictionary.
+            # session_id_to_load might be ignored here unless further logic is added.
+            session_dict = actual_data_to_process
+            print("Loaded single session dict for demo.")
+        elif isinstance(actual_data_to_process, np.ndarray):
+            # Handles cases where actual_data_to_process is an array of objects (e.g., dicts)
+            print(f"Data is a NumPy array with shape {actual_data_to_process.shape} and dtype {actual_data_to_process.dtype}.")
+            if actual_data_to_process.ndim >= 1: # Check if it's at least 1D
+                if 0 <= session_id_to_load < len(actual_data_to_process):
+                    potential_session = actual_data_to_process[session_id_to_load]
+                    if isinstance(potential_session, dict):
+                        session_dict = potential_session
+                        print(f"Loaded session {session_id_to_load} from NumPy array of objects for demo.")
+                    else:
+                        raise ValueError(f"Element at DEMO_ID {session_id_to_load} in NumPy array is not a dict, but {type(potential_session)}.")
                 else:
-                    raise ValueError(f"Element at DEMO_ID {session_id_to_load} in NumPy array is not a dict, but {type(potential_session)}.")
+                    raise ValueError(f"DEMO_ID {session_id_to_load} is out of bounds for the NumPy data array (length {len(actual_data_to_process)}).")
             else:
-                raise ValueError(f"DEMO_ID {session_id_to_load} is out of bounds for the NumPy data array (length {len(actual_data_to_process)}).")
+                raise TypeError(f"Unsupported NumPy array structure in {data_path_str}: shape {actual_data_to_process.shape}. Expected at least 1D array.")
         else:
-            raise TypeError(f"Unsupported NumPy array structure in {data_path_str}: shape {actual_data_to_process.shape}. Expected at least 1D array.")
-    else:
-        raise TypeError(f"Unsupported data type in {data_path_str} after initial processing: {type(actual_data_to_process)}")
+            raise TypeError(f"Unsupported data type in {data_path_str} after initial processing: {type(actual_data_to_process)}")
 
     if not session_dict:
         raise ValueError(f"Could not extract a valid session dictionary for DEMO_ID {session_id_to_load} from the data file.")
@@ -165,46 +319,96 @@ def load_demo_data(data_path_str="data/raw_run_data.npy", session_id_to_load=0):
         available = list(session_dict.keys())
         raise ValueError(f"Demo session data (ID: {session_id_to_load}) is missing required keys: {missing}. Available keys: {available}")
 
-    # Extract data using the confirmed keys
-    heart_rate = np.array(session_dict['heart_rate'])
-    speed = np.array(session_dict['speed'])
-    timestamp = np.array(session_dict['timestamp'])
+    # Extract data using the confirmed keys; dtype=float turns missing (None) samples into NaN
+    heart_rate = np.asarray(session_dict['heart_rate'], dtype=float)
+    speed = np.asarray(session_dict['speed'], dtype=float)
+    timestamp = np.asarray(session_dict['timestamp'], dtype=float)
+    if len(timestamp) == 0:
+        raise ValueError("Demo data is empty after initial processing.")
 
-    df = pd.DataFrame({
-        'timestamp': timestamp,
-        'heart_rate': heart_rate, # This column will be used by the model and plotting
-        'speed': speed            # This column will be used by the model and plotting
-    })
+    # Sort once by timestamp and measure time from the first sample, before cleaning as previously
+    order = np.argsort(timestamp, kind='stable')
+    heart_rate, speed, timestamp = heart_rate[order], speed[order], timestamp[order]
+    origin_timestamp = timestamp - timestamp[0]
 
-    df = df.sort_values('timestamp').reset_index(drop=True)
-    if df.empty:
-        raise ValueError("Demo data DataFrame is empty after initial processing.")
+    # Basic cleaning: remove NaNs and obvious invalids in a single mask, but not the extensive cleaning from model.py
+    mask = ~(np.isnan(heart_rate) | np.isnan(speed) | np.isnan(timestamp)) & (speed >= 0) & (heart_rate > 0)
 
-    df['origin_timestamp'] = df['timestamp'] - df['timestamp'].iloc[0]
-    
-    # Basic cleaning: remove NaNs and obvious invalids, but not the extensive cleaning from model.py
-    df = df.dropna(subset=['heart_rate', 'speed', 'timestamp'])
-    df = df[(df['speed'] >= 0) & (df['heart_rate'] > 0)]
-    df = df.reset_index(drop=True)
+    # Reading with dtype=float made every column float64; restore the integer columns
+    # once NaNs are masked out, so /demo_data keeps returning ints for them
+    df = pd.DataFrame({
+        'timestamp': _as_int_if_integral(timestamp[mask]),
+        'heart_rate': _as_int_if_integral(heart_rate[mask]), # This column will be used by the model and plotting
+        'speed': speed[mask],                                # This column will be used by the model and plotting
+        'origin_timestamp': _as_int_if_integral(origin_timestamp[mask])
+    }, copy=False)
 
     if df.empty:
         raise ValueError("Demo data DataFrame is empty after basic cleaning.")
     print(f"Demo data for session ID {session_id_to_load} loaded and processed. Shape: {df.shape}")
     return df
 
+def find_closest_index(sorted_values, t):
+    """
+    Binary-searches an ascending array for the index of the value closest to t.
+    On a tie the earlier index wins, matching idxmin().
+    """
+    i = np.searchsorted(sorted_values, t)
+    if i > 0 and (i == len(sorted_values) or abs(sorted_values[i - 1] - t) <= abs(sorted_values[i] - t)):
+        # Step back to the first occurrence of the smaller neighbour, in case it is duplicated
+        i = np.searchsorted(sorted_values, sorted_values[i - 1])
+    return int(i)
+
 def initialize_app():
-    global predictor, demo_item_df
+    global predictor, batcher, _N, _TS, _HR, _SPEED, _ORIGIN_TS, _FEATURES
+    global _MODEL_WINDOW_SAMPLES, _SAMPLES_TO_ADVANCE
     print("Initializing Flask app...")
     try:
+        # Load the demo arrays before any model setup
+        demo_data_path = STRUCTURED_DEMO_DATA_PATH if Path(STRUCTURED_DEMO_DATA_PATH).exists() else DEMO_DATA_PATH
+        demo_item_df = load_demo_data(demo_data_path, session_id_to_load=DEMO_ID)
+        print(f"Demo data for session ID {DEMO_ID} loaded successfully.")
+        _N = len(demo_item_df)
+        _TS = demo_item_df['timestamp'].to_numpy()
+        _HR = demo_item_df['heart_rate'].to_numpy()
+        _SPEED = demo_item_df['speed'].to_numpy()
+        _ORIGIN_TS = demo_item_df['origin_timestamp'].to_numpy()
+        _FEATURES = np.ascontiguousarray(demo_item_df[['speed', 'heart_rate']].to_numpy(dtype=np.float32))
+
         predictor = FitRecSpeedPredictor() # Initialize with default or loaded params
         predictor.load_model_config(MODEL_CONFIG_PATH)
         print(f"Model loaded successfully from {MODEL_CONFIG_PATH}.")
 
-        demo_item_df = load_demo_data(session_id_to_load=DEMO_ID)
-        print(f"Demo data for session ID {DEMO_ID} loaded successfully.")
-
-        if demo_item_df is not None and not demo_item_df.empty:
+        # load_model_config guarantees sampling_rate > 0, so these only need computing once
+        _MODEL_WINDOW_SAMPLES = int(predictor.window_duration / predictor.sampling_rate)
+        if _MODEL_WINDOW_SAMPLES <= 0:
+            raise ValueError(f"Invalid model window configuration (window_samples={_MODEL_WINDOW_SAMPLES})")
+        # Round rather than truncate, so e.g. 2.9999 samples doesn't silently become 2 (or 0 -> 1)
+        _SAMPLES_TO_ADVANCE = max(1, int(round(predictor.prediction_duration / predictor.sampling_rate)))
+        print(f"model_window_samples={_MODEL_WINDOW_SAMPLES}, samples_to_advance={_SAMPLES_TO_ADVANCE}")
+
+        # Compile and warm up the model for power-of-two batch sizes up to MAX_BATCH,
+        # so no request pays for graph tracing or XLA compilation
+        inference_batch_sizes = [2 ** i for i in range(MAX_BATCH.bit_length()) if 2 ** i < MAX_BATCH] + [MAX_BATCH]
+        try:
+            predictor.compile_for_inference(batch_sizes=inference_batch_sizes)
+        except Exception as compile_e:
+            # Compilation is only an optimization; keep serving through model.predict
+            # compile_for_inference only installs the compiled function after every warm-up succeeds
+            print(f"Warning: could not compile the inference graph, falling back to model.predict: {compile_e}")
+        predictor.predict(np.zeros((_MODEL_WINDOW_SAMPLES, 2), dtype=np.float32))
+
+        batcher = PredictionBatcher(predictor, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS)
+        print(f"Prediction batcher started (max_batch={MAX_BATCH}, max_wait_ms={MAX_WAIT_MS}).")
+
+        # The DataFrame itself is only needed for plotting and is dropped after initialization
+        if GENERATE_DEMO_PLOT:
             try:
+                # Imported lazily so a normal startup never loads matplotlib
+                import matplotlib
+                matplotlib.use('Agg') # Use Agg backend for non-interactive plotting
+                import matplotlib.pyplot as plt
+
                 fig, ax1 = plt.subplots(figsize=(12, 6))
                 color = 'tab:red'
                 ax1.set_xlabel('Origin Timestamp (seconds)')
@@ -227,8 +431,8 @@ def initialize_app():
                 ax2.legend(lines + lines2, labels + labels2, loc='upper right')
 
                 plot_filename = f"demo_{DEMO_ID}.png"
-                # plt.savefig(plot_filename)
-                # plt.close(fig)
+                plt.savefig(plot_filename)
+                plt.close(fig)
                 print(f"Demo data plot saved to {plot_filename}")
             except Exception as plot_e:
                 print(f"Error generating or saving demo data plot: {plot_e}")
@@ -239,17 +443,37 @@ def initialize_app():
         # Optionally, exit or run in a degraded mode if critical components are missing
         # For now, we'll let Flask start but endpoints might fail.
         predictor = None # Ensure predictor is None if loading failed
-        demo_item_df = None
+        batcher = None
+        _N = 0
+        _TS = None
+        _HR = None
+        _SPEED = None
+        _ORIGIN_TS = None
+        _FEATURES = None
     except Exception as e:
         print(f"An error occurred during initialization: {e}")
         predictor = None
-        demo_item_df = None
+        batcher = None
+        _N = 0
+        _TS = None
+        _HR = None
+        _SPEED = None
+        _ORIGIN_TS = None
+        _FEATURES = None
+
+def create_app():
+    """
+    App factory for production WSGI servers, e.g.
+    gunicorn -k gthread -w 1 --threads 8 'predict:create_app()'
+    Keep a single worker so all requests share one model replica and its batcher.
+    """
+    initialize_app()
+    return app
 
 
 @app.route('/demo_predict', methods=['GET'])
 def demo_predict_api():
-    global predictor, demo_item_df
-    if predictor is None or predictor.model is None or demo_item_df is None or demo_item_df.empty:
+    if predictor is None or predictor.model is None or batcher is None or _N == 0:
         return jsonify({"error": "Service not initialized or demo data/model not loaded"}), 500
 
     try:
@@ -258,57 +482,40 @@ def demo_predict_api():
             return jsonify({"error": "Missing 'idx' parameter"}), 400
 
         idx = int(idx_str)
-        if not (0 <= idx < len(demo_item_df)):
-            return jsonify({"error": f"idx {idx} is out of bounds for demo_item_df (length {len(demo_item_df)})"}), 400
+        if not (0 <= idx < _N):
+            return jsonify({"error": f"idx {idx} is out of bounds for the demo data (length {_N})"}), 400
 
-        if predictor.sampling_rate <= 0:
-             return jsonify({"error": "Invalid model sampling rate configuration."}), 500
-        model_window_samples = int(predictor.window_duration / predictor.sampling_rate)
+        start_index_for_model_input = max(0, idx - _MODEL_WINDOW_SAMPLES + 1)
+        # Row slice of a C-contiguous array is itself contiguous, no copy needed
+        input_array = _FEATURES[start_index_for_model_input : idx + 1]
 
-        if model_window_samples <= 0:
-             return jsonify({"error": "Invalid model window configuration (window_samples <= 0)"}), 500
-
-        start_index_for_model_input = max(0, idx - model_window_samples + 1)
-        input_sequence_df = demo_item_df.iloc[start_index_for_model_input : idx + 1]
-
-        if len(input_sequence_df) < model_window_samples:
+        if len(input_array) < _MODEL_WINDOW_SAMPLES:
             return jsonify({
-                "error": f"Not enough data points ({len(input_sequence_df)}) to form model input window of {model_window_samples} samples ending at index {idx}."
+                "error": f"Not enough data points ({len(input_array)}) to form model input window of {_MODEL_WINDOW_SAMPLES} samples ending at index {idx}."
             }), 400
-        
-        input_array = input_sequence_df[['speed', 'heart_rate']].values
-        
-        if input_array.shape[0] != model_window_samples or input_array.shape[1] != 2:
-             return jsonify({
-                "error": f"Prepared input array shape {input_array.shape} does not match model expectation ({model_window_samples}, 2)."
-            }), 500
 
         # Timestamp of the last data point in the input window (i.e., at idx)
-        current_input_end_origin_timestamp = demo_item_df['origin_timestamp'].iloc[idx]
-        predicted_speed = predictor.predict(input_array)
-
-        samples_to_advance = int(predictor.prediction_duration / predictor.sampling_rate)
-        print(f"samples_to_advance={samples_to_advance}")
-        if samples_to_advance <=0: samples_to_advance = 1 
-
-        next_idx_val = min(idx + samples_to_advance, len(demo_item_df) - 1)
-        
-        next_idx_origin_timestamp = -1.0 # Default if somehow next_idx_val is out of bounds after calculation
-        if 0 <= next_idx_val < len(demo_item_df):
-            next_idx_origin_timestamp = demo_item_df['origin_timestamp'].iloc[next_idx_val]
-        else: # Should not happen if logic is correct, but as a safeguard
-            print(f"Warning: next_idx_val {next_idx_val} is out of bounds for demo_item_df (len {len(demo_item_df)}) after advancing.")
+        current_input_end_origin_timestamp = _ORIGIN_TS[idx]
+        # Shares a single model call with any other requests in flight
+        predicted_speed = batcher.predict(input_array, timeout=PREDICT_TIMEOUT_S)
 
+        # idx >= 0 and samples_to_advance >= 1, so next_idx_val is always a valid index
+        next_idx_val = min(idx + _SAMPLES_TO_ADVANCE, _N - 1)
+        next_idx_origin_timestamp = _ORIGIN_TS[next_idx_val]
 
         return jsonify({
-            "predicted_speed": float(predicted_speed),
-            "next_idx": int(next_idx_val),
-            "current_input_end_origin_timestamp": float(current_input_end_origin_timestamp),
-            "next_idx_origin_timestamp": float(next_idx_origin_timestamp)
+            "predicted_speed": predicted_speed,
+            "next_idx": next_idx_val,
+            "current_input_end_origin_timestamp": current_input_end_origin_timestamp,
+            "next_idx_origin_timestamp": next_idx_origin_timestamp
         })
 
     except ValueError as e:
         return jsonify({"error": f"Invalid parameter value: {e}"}), 400
+    except queue.Full:
+        return jsonify({"error": "Prediction queue is full, try again later"}), 503
+    except FutureTimeoutError:
+        return jsonify({"error": f"Prediction did not complete within {PREDICT_TIMEOUT_S} seconds, try again later"}), 504
     except Exception as e:
         app.logger.error(f"Error in /demo_predict: {e}", exc_info=True)
         return jsonify({"error": f"An internal error occurred: {e}"}), 500
@@ -316,8 +523,7 @@ def demo_predict_api():
 
 @app.route('/demo_data', methods=['GET'])
 def demo_data_api():
-    global demo_item_df
-    if demo_item_df is None or demo_item_df.empty:
+    if _N == 0:
         return jsonify({"error": "Demo data not loaded"}), 500
 
     try:
@@ -326,22 +532,17 @@ def demo_data_api():
             return jsonify({"error": "Missing 't' (origin_timestamp) parameter"}), 400
         
         t = float(t_str)
+        if not math.isfinite(t): # float() also accepts 'nan' and 'inf'
+            return jsonify({"error": "Invalid 't' parameter, must be a finite number"}), 400
 
-        # Find the row where origin_timestamp is closest to t
-        closest_idx = (demo_item_df['origin_timestamp'] - t).abs().idxmin()
-        result_row = demo_item_df.loc[closest_idx].to_dict()
-
-        # Convert numpy types to native Python types for JSON serialization
-        for key, value in result_row.items():
-            if isinstance(value, np.integer):
-                result_row[key] = int(value)
-            elif isinstance(value, np.floating):
-                result_row[key] = float(value)
-            elif isinstance(value, np.bool_):
-                 result_row[key] = bool(value)
-
-
-        return jsonify(result_row)
+        # Find the row where origin_timestamp is closest to t (origin_timestamp is sorted)
+        closest_idx = find_closest_index(_ORIGIN_TS, t)
+        return jsonify({
+            "timestamp": _TS[closest_idx],
+            "heart_rate": _HR[closest_idx],
+            "speed": _SPEED[closest_idx],
+            "origin_timestamp": _ORIGIN_TS[closest_idx]
+        })
 
     except ValueError:
         return jsonify({"error": "Invalid 't' parameter, must be a number"}), 400
@@ -351,7 +552,8 @@ def demo_data_api():
 
 if __name__ == '__main__':
     initialize_app()
-    if predictor is None or demo_item_df is None:
+    if predictor is None or _N == 0:
         print("Failed to initialize critical components. The app might not work correctly.")
         print("Please ensure model.json, model_weights.h5 and data/run_sample_10000.npy are present and correct.")
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    # Development server only; use gunicorn with create_app() in production
+    app.run(host='0.0.0.0', port=8080, threaded=True)